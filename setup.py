@@ -25,10 +25,14 @@ setup(
         'setuptools>=39.2.0',
         'numpy>=1.14.5',
         'pyqtgraph>=0.10.0',
-        'h5py>=2.8.0',
+        'h5py>=2.10.0',
         'pyqt5>=5.10.1'
     ],
 
+    extras_require={
+        'numba': ['numba>=0.47'],
+    },
+
     classifiers=[
         "Development Status :: 3 - Alpha",
         "License :: OSI Approved :: MIT License",
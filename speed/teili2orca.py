@@ -17,14 +17,264 @@ for more information please refer to the [installation instructions](https://tei
 # @Date: 12/09/2019
 
 import os
+import sys
+import functools
 import numpy as np
 import pickle
-import collections
-from brian2 import Network, Synapses, NeuronGroup
-from brian2 import SpikeGeneratorGroup, PoissonGroup
+from collections.abc import Mapping
+from brian2 import Network, Synapses, NeuronGroup, SpikeGeneratorGroup, \
+    PoissonGroup
 
 from teili import TeiliNetwork, Connections, Neurons
 
+_IO_BUFFER_SIZE = 1 << 20
+# Number of low-precision weights upcast to float64 at a time
+_UPCAST_CHUNK_SIZE = 1 << 16
+# Smaller HDF5 datasets are stored contiguous and uncompressed
+_HDF5_COMPRESS_MIN_BYTES = 4096
+
+# teili tags which carry no information for ORCA
+_TAG_DROP = frozenset({'mismatch', 'noise', 'level', 'num_inputs',
+                       'bb_type', 'group_type', 'connection_type'})
+
+# Maps the type of a network object to the attribute collecting it
+_BUCKETS = {Neurons: 'neuron_groups',
+            NeuronGroup: 'neuron_groups',
+            Connections: 'conn_groups',
+            Synapses: 'conn_groups',
+            PoissonGroup: 'poisson_groups',
+            SpikeGeneratorGroup: 'spikegen_groups'}
+
+
+@functools.lru_cache(maxsize=None)
+def _bucket_of(klass):
+    """Looks up the bucket of a network object type. Exact types are
+    resolved with a single dictionary lookup, subclasses fall back to
+    the first base class found in `_BUCKETS`. The result is cached per
+    type, so the MRO of a type is only walked once.
+
+    Args:
+        klass (type): Type of the network object.
+
+    Returns:
+        str: Name of the attribute collecting objects of this type, or
+            None if the type is not relevant for ORCA.
+    """
+    bucket = _BUCKETS.get(klass)
+    if bucket is None:
+        for base in klass.__mro__[1:]:
+            bucket = _BUCKETS.get(base)
+            if bucket is not None:
+                break
+    return bucket
+
+
+# Compiled by `_get_weight_sums_kernel`, False if numba is not installed
+_weight_sums_kernel = None
+
+
+def _get_weight_sums_kernel():
+    """Imports `numba` and compiles the kernel summing the weights on
+    first use, so that importing this module does not pay for importing
+    `numba`. `numba` is optional.
+
+    Returns:
+        callable: Kernel returning sum and sum of squares of a 1D array,
+            accumulated in float64 independent of the precision of the
+            array, or None if `numba` is not installed.
+    """
+    global _weight_sums_kernel
+    if _weight_sums_kernel is None:
+        try:
+            from numba import njit
+        except ImportError:
+            _weight_sums_kernel = False
+        else:
+            @njit(fastmath={'reassoc', 'contract'}, cache=True)
+            def weight_sums(w):
+                s = 0.0
+                ss = 0.0
+                for i in range(w.size):
+                    v = float(w[i])
+                    s += v
+                    ss += v * v
+                return s, ss
+
+            _weight_sums_kernel = weight_sums
+    return _weight_sums_kernel or None
+
+
+def _output_path(filename, directory, extensions):
+    """Builds the full path of an exported network file. If no directory
+    is provided `~/teiliApps/output/` is used and created if necessary.
+
+    Args:
+        filename (str): Desired name of the file.
+        directory (str): Desired directory of the file or None.
+        extensions (tuple): Accepted file extensions. If the filename has
+            none of them, the first one is appended.
+
+    Returns:
+        str: Filename with full path and file extension.
+    """
+    if directory is None:
+        directory = os.path.join(os.path.expanduser('~'),
+                                 'teiliApps',
+                                 'output')
+        os.makedirs(directory, exist_ok=True)
+
+    if not filename.lower().endswith(extensions):
+        filename = filename + extensions[0]
+    return os.path.join(directory, filename)
+
+
+def _write_hdf5_group(group, dictionary, string_dtype):
+    """Recursively writes a (nested) dictionary to an HDF5 group.
+    Nested dictionaries become sub-groups, arrays become datasets
+    (chunked and LZF compressed from `_HDF5_COMPRESS_MIN_BYTES`) and scalars
+    become attributes. Strings are stored as variable-length UTF-8
+    strings and `brian2` quantities in SI units, with the unit stored as
+    attribute `unit` of the dataset or as attribute `<key>_unit` of the
+    group respectively.
+
+    Args:
+        group (h5py.Group): Group to write to.
+        dictionary (Mapping): Content to write.
+        string_dtype (np.dtype): HDF5 string type, i.e.
+            `h5py.string_dtype()`.
+
+    Raises:
+        TypeError: If a value is neither a dictionary, a number, a
+            string nor an array of numbers or strings.
+    """
+    for key, value in dictionary.items():
+        key = str(key)
+        if isinstance(value, Mapping):
+            _write_hdf5_group(group.create_group(key), value, string_dtype)
+            continue
+
+        value_type = type(value).__name__
+        unit = getattr(value, 'dim', None)
+        if isinstance(value, (list, tuple)) and \
+                any(isinstance(v, str) for v in value):
+            # Keeps mixed lists, e.g. [1, 'x'], from becoming strings
+            value = np.array(value, dtype=object)
+        else:
+            value = np.asarray(value)
+
+        dtype = value.dtype
+        if dtype.kind == 'U':
+            value = value.astype(object)
+            dtype = string_dtype
+        elif dtype.kind == 'O':
+            if not all(isinstance(v, str) for v in value.flat):
+                raise TypeError("Cannot store '{}' of type {} in HDF5"
+                                .format(key, value_type))
+            dtype = string_dtype
+
+        if value.ndim > 0:
+            if value.nbytes >= _HDF5_COMPRESS_MIN_BYTES:
+                dataset = group.create_dataset(key, data=value, dtype=dtype,
+                                               compression='lzf',
+                                               shuffle=True, chunks=True)
+            else:
+                dataset = group.create_dataset(key, data=value, dtype=dtype)
+            if unit is not None:
+                dataset.attrs['unit'] = str(unit)
+        else:
+            group.attrs.create(key, value, dtype=dtype)
+            if unit is not None:
+                group.attrs[key + '_unit'] = str(unit)
+
+
+def _materializing(method):
+    """Wraps a `dict` method of `_LazyDict` such that all pending values
+    are computed before the method is called.
+    """
+    def wrapper(self, *args, **kwargs):
+        self._materialize()
+        return method(self, *args, **kwargs)
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+class _LazyDict(dict):
+    """Dictionary whose values can be given as factories, which are
+    called the first time the value is looked up and cached afterwards.
+    Looking up single keys with `[]`, `get` or `in` only computes the
+    requested value, every other access (iteration, `len`, `items`,
+    `update`, pickling, ...) first computes all pending values, after
+    which it behaves like a plain `dict`. It is pickled as a plain `dict`.
+
+    Args:
+        values (dict): {'key': value} for values which are already known
+        factories (dict): {'key': callable without arguments}
+    """
+
+    __slots__ = ('_order', '_factories')
+
+    def __init__(self, values, factories):
+        super().__init__(values)
+        self._order = list(values) + list(factories)
+        self._factories = dict(factories)
+
+    def __missing__(self, key):
+        if key not in self._factories:
+            raise KeyError(key)
+        value = self._factories[key]()
+        self[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._factories.pop(key, None)
+        super().__setitem__(key, value)
+
+    def __contains__(self, key):
+        return super().__contains__(key) or key in self._factories
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def _materialize(self):
+        """Computes all pending values and restores the original key order.
+        """
+        if not self._factories:
+            return
+        for key in list(self._factories):
+            self[key]
+        ordered = {key: dict.__getitem__(self, key)
+                   for key in self._order if dict.__contains__(self, key)}
+        ordered.update(dict.items(self))
+        dict.clear(self)
+        dict.update(self, ordered)
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+    __iter__ = _materializing(dict.__iter__)
+    __reversed__ = _materializing(dict.__reversed__)
+    __len__ = _materializing(dict.__len__)
+    __repr__ = _materializing(dict.__repr__)
+    __eq__ = _materializing(dict.__eq__)
+    __ne__ = _materializing(dict.__ne__)
+    __delitem__ = _materializing(dict.__delitem__)
+    if hasattr(dict, '__or__'):
+        # The | operators only exist since Python 3.9
+        __or__ = _materializing(dict.__or__)
+        __ror__ = _materializing(dict.__ror__)
+        __ior__ = _materializing(dict.__ior__)
+    keys = _materializing(dict.keys)
+    values = _materializing(dict.values)
+    items = _materializing(dict.items)
+    copy = _materializing(dict.copy)
+    pop = _materializing(dict.pop)
+    popitem = _materializing(dict.popitem)
+    setdefault = _materializing(dict.setdefault)
+    update = _materializing(dict.update)
+    clear = _materializing(dict.clear)
+
 
 class Speed(TeiliNetwork, Network):
     """This class provides the first iteration of a high-level
@@ -59,9 +309,17 @@ class Speed(TeiliNetwork, Network):
             *  plastic      (bool) : True | False
             *  mean         (float): [0, 1]
             *  std          (float): [0, 1]
+        synapse_tags_soa (dict): The synapse tags stored column-wise,
+            i.e. {'tag': np.ndarray} with one entry per synapse group
+            and the group identifiers in 'name'. Only set by
+            `extract_synapse_tag_arrays`, it is not part of `net_dict`.
         net_dict (dict): Dictionary containing all necessary information
-            to program the ORCA processor. The dictionary is structured
-            as following:
+            to program the ORCA processor. `n_total` and `s_total` are
+            counted when the object is created, all other entries are
+            extracted from the network when they are first accessed (which
+            is also when the corresponding attribute above is set), so they
+            reflect the state of the network at that time. The dictionary
+            is structured as following:
             *  total_n (int): Total number of neurons
             *  total_s (int): Total number of synapses
             *  n_pop (dict): {'unique population ID': N}
@@ -72,39 +330,54 @@ class Speed(TeiliNetwork, Network):
 
     """
 
+    # The base classes still provide a __dict__, but the slots give faster
+    # access to the attributes used during extraction.
+    __slots__ = ('neuron_groups', 'conn_groups', 'poisson_groups',
+                 'spikegen_groups', 'neuron_populations',
+                 'synapse_populations', 'synapse_tags', 'synapse_tags_soa',
+                 'synapse_params', 'neuron_params', 'net_dict',
+                 'total_num_neurons', 'total_num_synapses', '_syn_counts')
+
     def __init__(self, net):
-        """Summary
+        """Collects the groups of the network and counts neurons and
+        synapses. Populations, parameters and synapse tags (including the
+        weight statistics) are only read from the network when the
+        corresponding `net_dict` entry is first accessed, e.g. by
+        `print_network`, `save_to_file` or `save_to_hdf5`. To export the
+        initial state of a network, print or save it before running it.
 
         Args:
-            net (TYPE): Description
+            net (Network): `TeiliNetwork` or `brian2` `Network` to convert.
         """
-        self.neuron_groups = {att.name: att for att in net.__dict__['objects']
-                              if type(att) == Neurons or type(att) == NeuronGroup}
-        self.conn_groups = {att.name: att for att in net.__dict__['objects']
-                            if type(att) == Connections or type(att) == Synapses}
-        self.poisson_groups = {att.name: att for att in net.__dict__['objects']
-                               if type(att) == PoissonGroup}
-        self.spikegen_groups = {att.name: att for att in net.__dict__['objects']
-                                if type(att) == SpikeGeneratorGroup}
+        self.neuron_groups = {}
+        self.conn_groups = {}
+        self.poisson_groups = {}
+        self.spikegen_groups = {}
 
         self.total_num_neurons = 0
         self.total_num_synapses = 0
-
-        for group_key in self.neuron_groups:
-            self.total_num_neurons += self.neuron_groups[group_key].N
-
-        for group_key in self.conn_groups:
-            self.total_num_synapses += len(self.conn_groups[group_key])
-
-        self.net_dict = collections.OrderedDict()
-        self.net_dict = {'n_total': self.total_num_neurons,
-                         's_total': self.total_num_synapses,
-                         'n_pop': self.extract_neuron_groups(),
-                         's_pop': self.extract_synapse_groups(),
-                         's_tags': self.extract_synapse_tags(),
-                         'n_params': self.extract_neuron_parameters(),
-                         's_params': self.extract_synapse_parameters(),
-                         }
+        # len() of a Synapses object can be costly, so it is counted once
+        self._syn_counts = {}
+
+        for att in net.objects:
+            bucket = _bucket_of(type(att))
+            if bucket is None:
+                continue
+            getattr(self, bucket)[att.name] = att
+            if bucket == 'neuron_groups':
+                self.total_num_neurons += att.N
+            elif bucket == 'conn_groups':
+                num_synapses = self._syn_counts[att.name] = len(att)
+                self.total_num_synapses += num_synapses
+
+        self.net_dict = _LazyDict({'n_total': self.total_num_neurons,
+                                   's_total': self.total_num_synapses},
+                                  {'n_pop': self.extract_neuron_groups,
+                                   's_pop': self.extract_synapse_groups,
+                                   's_tags': self.extract_synapse_tags,
+                                   'n_params': self.extract_neuron_parameters,
+                                   's_params': self.extract_synapse_parameters,
+                                   })
 
     def extract_neuron_groups(self):
         """ This function extracts all present `NeuronGroup`/`Neurons` from
@@ -114,9 +387,8 @@ class Speed(TeiliNetwork, Network):
             dict: {'unique population ID': N}
         """
         self.neuron_populations = {}
-        for group_key in self.neuron_groups:
-            num_neurons = self.neuron_groups[group_key].N
-            self.neuron_populations.update({group_key: num_neurons})
+        for group_key, group in self.neuron_groups.items():
+            self.neuron_populations.update({group_key: group.N})
 
         return self.neuron_populations
 
@@ -128,9 +400,8 @@ class Speed(TeiliNetwork, Network):
             dict: {'unique synapse ID': [ID_pre, ID_post]}
         """
         self.synapse_populations = {}
-        for group_key in self.conn_groups:
-            pre_post = [self.conn_groups[group_key].source.name,
-                        self.conn_groups[group_key].target.name]
+        for group_key, conn in self.conn_groups.items():
+            pre_post = [conn.source.name, conn.target.name]
             self.synapse_populations.update({group_key: pre_post})
 
         return self.synapse_populations
@@ -153,38 +424,95 @@ class Speed(TeiliNetwork, Network):
                 *  std          (float): [0, 1]
         """
         self.synapse_tags = {}
-        for group_key in self.conn_groups:
-            current_tags = self.conn_groups[group_key]._tags
-            current_tags.pop('mismatch', None)
-            current_tags.pop('noise', None)
-            current_tags.pop('level', None)
-            current_tags.pop('num_inputs', None)
-            current_tags.pop('bb_type', None)
-            current_tags.pop('group_type', None)
-            current_tags.pop('connection_type', None)
-
-            if 'taupre' in self.conn_groups[group_key]._init_parameters:
-                current_tags.update({'plastic': True})
-            else:
-                current_tags.update({'plastic': False})
-
-            p_connection = len(self.conn_groups[group_key]) / \
-                (self.conn_groups[group_key].source.N *
-                 self.conn_groups[group_key].target.N)
-
-            current_tags.update({'p_connection': p_connection})
-            current_tags.update({'mean':
-                                 np.round(np.mean(
-                                     self.conn_groups
-                                     [group_key].w_plast), 4)})
-            current_tags.update({'std':
-                                 np.round(np.std(
-                                     self.conn_groups
-                                     [group_key].w_plast), 4)})
+        for group_key, conn in self.conn_groups.items():
+            current_tags = {k: v for k, v in conn._tags.items()
+                            if k not in _TAG_DROP}
+
+            p_connection = self._syn_counts[group_key] / \
+                (conn.source.N * conn.target.N)
+            mean, std = self._weight_stats(conn.w_plast)
+
+            current_tags.update(plastic='taupre' in conn._init_parameters,
+                                p_connection=p_connection,
+                                mean=np.round(mean, 4),
+                                std=np.round(std, 4))
 
             self.synapse_tags.update({group_key: current_tags})
         return self.synapse_tags
 
+    def extract_synapse_tag_arrays(self):
+        """This function stores the synapse tags in a column-wise layout
+        (struct of arrays), i.e. one array per tag holding the value of
+        every synapse group, such that the ORCA compiler can process a tag
+        for all synapse groups at once.
+
+        Returns:
+            dict: {'tag': np.ndarray}, where the i-th entry of each array
+                belongs to the synapse group `name[i]`.
+        """
+        synapse_tags = self.net_dict['s_tags']
+        num_groups = len(synapse_tags)
+        self.synapse_tags_soa = {
+            'name': np.array(list(synapse_tags), dtype=object),
+            'sign': np.empty(num_groups, dtype=object),
+            'target_sign': np.empty(num_groups, dtype=object),
+            'p_connection': np.zeros(num_groups),
+            'plastic': np.zeros(num_groups, dtype=bool),
+            'mean': np.zeros(num_groups),
+            'std': np.zeros(num_groups)}
+
+        for i, tags in enumerate(synapse_tags.values()):
+            self.synapse_tags_soa['sign'][i] = tags.get('sign', '')
+            self.synapse_tags_soa['target_sign'][i] = \
+                tags.get('target_sign', '')
+            self.synapse_tags_soa['p_connection'][i] = tags['p_connection']
+            self.synapse_tags_soa['plastic'][i] = tags['plastic']
+            self.synapse_tags_soa['mean'][i] = tags['mean']
+            self.synapse_tags_soa['std'][i] = tags['std']
+
+        return self.synapse_tags_soa
+
+    @staticmethod
+    def _weight_stats(w_plast):
+        """Computes mean and standard deviation of the synaptic weights
+        from a single pass over the weight array, i.e. sum and sum of
+        squares are accumulated and the moments are derived from them.
+        If `numba` is installed, both sums are computed by a compiled
+        kernel, which avoids the NumPy call overhead that dominates for
+        many small synapse groups. Otherwise weights of lower precision
+        than float64 (e.g. if brian2's `default_float_dtype` is float32)
+        are upcast in chunks, since a float32 dot product is not accurate
+        enough for the variance.
+
+        Args:
+            w_plast (array-like): Plastic weights of a synapse group.
+
+        Returns:
+            tuple: (mean, std)
+        """
+        w = np.asarray(w_plast).ravel()
+        n = w.size
+        if n == 0:
+            return np.nan, np.nan
+        kernel = _get_weight_sums_kernel()
+        if kernel is not None:
+            total, total_sq = kernel(np.ascontiguousarray(w))
+            mean = total / n
+            mean_sq = total_sq / n
+        elif w.dtype == np.float64:
+            mean = w.sum() / n
+            mean_sq = np.dot(w, w) / n
+        else:
+            total = 0.0
+            total_sq = 0.0
+            for start in range(0, n, _UPCAST_CHUNK_SIZE):
+                chunk = w[start:start + _UPCAST_CHUNK_SIZE].astype(np.float64)
+                total += chunk.sum()
+                total_sq += np.dot(chunk, chunk)
+            mean = total / n
+            mean_sq = total_sq / n
+        return mean, np.sqrt(max(mean_sq - mean * mean, 0.0))
+
     def extract_neuron_parameters(self):
         """ This function extracts the initial neuron paramter.
         At the moment we assume that the network **does not** have
@@ -194,10 +522,8 @@ class Speed(TeiliNetwork, Network):
             dict: {'unique popluation ID': parameters}
         """
         self.neuron_params = {}
-        for group_key in self.neuron_groups:
-            self.neuron_params.update({group_key:
-                                       self.neuron_groups
-                                       [group_key]._init_parameters})
+        for group_key, group in self.neuron_groups.items():
+            self.neuron_params[group_key] = group._init_parameters
         return self.neuron_params
 
     def extract_synapse_parameters(self):
@@ -209,10 +535,8 @@ class Speed(TeiliNetwork, Network):
             dict: {'unique synapse ID': parameters}
         """
         self.synapse_params = {}
-        for group_key in self.conn_groups:
-            self.synapse_params.update({group_key:
-                                        self.conn_groups
-                                        [group_key]._init_parameters})
+        for group_key, conn in self.conn_groups.items():
+            self.synapse_params[group_key] = conn._init_parameters
         return self.synapse_params
 
     def save_to_file(self, filename, directory=None):
@@ -225,50 +549,63 @@ class Speed(TeiliNetwork, Network):
                 If no directory is provided the file is saved to:
                 `~/teiliApps/output/`
         """
+        filename = _output_path(filename, directory, ('.p', '.pickle'))
 
-        if directory is None:
-            directory = os.path.join(os.path.expanduser('~'),
-                                     'teiliApps',
-                                     'output')
-            if not os.path.exists(directory):
-                os.makedirs(directory)
-
-        if filename[-2:] == '.p' or filename[-7:] == '.pickle':
-            filename = os.path.join(directory,
-                                    filename)
-        else:
-            filename = filename + '.p'
-            filename = os.path.join(directory,
-                                    filename)
-
-        with open(filename, 'wb') as handle:
-            pickle.dump(self.net_dict, handle,
+        with open(filename, 'wb', buffering=_IO_BUFFER_SIZE) as handle:
+            pickle.dump(dict(self.net_dict), handle,
                         protocol=pickle.HIGHEST_PROTOCOL)
 
             print('Network description saved to: \n {}'
                   .format(filename))
 
+    def save_to_hdf5(self, filename, directory=None):
+        """Saves the network description to an HDF5 file. In contrast to
+        `save_to_file` the arrays are stored compressed and can be read
+        partially, which is preferable for large networks.
+        The file mirrors the structure of `net_dict`, e.g. `n_total` is an
+        attribute of the root group and the parameters of a synapse group
+        are found in `/s_params/<unique synapse ID>`.
+
+        Args:
+            filename (str): Desired name to store the network dictionary as
+            directory (str, optional): Desired directory to save the network file.
+                If no directory is provided the file is saved to:
+                `~/teiliApps/output/`
+        """
+        import h5py
+
+        filename = _output_path(filename, directory, ('.h5', '.hdf5'))
+
+        with h5py.File(filename, 'w') as handle:
+            _write_hdf5_group(handle, self.net_dict, h5py.string_dtype())
+
+        print('Network description saved to: \n {}'
+              .format(filename))
+
     def load_from_file(self, filename):
         """ Wrapper function to load previously exported network.
 
         Args:
             filename (str): Filename with full path and file extension.
         """
-        with open(filename, 'rb') as handle:
+        with open(filename, 'rb', buffering=_IO_BUFFER_SIZE) as handle:
             self.net_dict = pickle.load(handle)
 
     def print_network(self):
         """Simple print function for quick check
         """
-        for k,v in self.net_dict.items():
-            if type(v) == dict:
-                print(k)
+        lines = []
+        for k, v in self.net_dict.items():
+            if isinstance(v, dict):
+                lines.append(str(k))
                 for kk, vv in v.items():
-                    if type(vv) == dict:
-                        print('  ', kk)
+                    if isinstance(vv, dict):
+                        lines.append('   {}'.format(kk))
                         for kkk, vvv in vv.items():
-                            print('    ', kkk, ': ', vvv)
+                            lines.append('     {} :  {}'.format(kkk, vvv))
                     else:
-                        print('  ', kk, ': ', vv)
+                        lines.append('   {} :  {}'.format(kk, vv))
             else:
-                print(k, v)
+                lines.append('{} {}'.format(k, v))
+
+        sys.stdout.write('\n'.join(lines) + '\n')
@@ -11,6 +11,8 @@ from teili.models.synapse_models import ExponentialStdp as plastic_synapse_model
 
 from speed.teili2orca import Speed
 
+simulate = False
+
 # Defining the network
 N = 1000
 F = 8*Hz
@@ -34,10 +36,8 @@ S.taupost = 20 * ms
 
 Net.add(input, neurons, S)
 
-# Simulating the networ
-Net.run(10*second, report='text')
-
-# Converting the network
+# Converting the network. The converter only reads the structure and the
+# initial parameters, so there is no need to simulate the network first.
 converted_model = Speed(Net)
 
 # Example of how print neuron equation from the original network
@@ -49,3 +49,7 @@ converted_model.print_network()
 # Save the converted model to a file which can be loaded by the ORCA compiler
 converted_model.save_to_file(filename='orca_net.p',
                              directory=os.path.expanduser('~'))
+
+# Simulating the network is not needed for the conversion
+if simulate:
+    Net.run(10*second, report='text')
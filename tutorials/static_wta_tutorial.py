@@ -82,9 +82,8 @@ spikemonitor_noise = SpikeMonitor(
 Net.add(test_WTA, testbench.noise_input, noise_syn,
         statemonWTAin, spikemonitor_noise, spikemonitor_input)
 
-Net.run(duration=duration * ms, report='text')
-
-# Converting the network
+# Converting the network. The converter only reads the structure and the
+# initial parameters, so it is done before simulating the network.
 converted_model = Speed(Net)
 
 converted_model.save_to_file(filename='orca_net.p',
@@ -93,6 +92,9 @@ if visual_inspection:
     converted_model.print_network()
 
 if visual_inspection:
+    # The simulation is only needed for the visual inspection
+    Net.run(duration=duration * ms, report='text')
+
     app = QtGui.QApplication.instance()
     if app is None:
             app = QtGui.QApplication(sys.argv)